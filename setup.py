@@ -28,6 +28,7 @@ setup(
     install_requires=[
         'mkdocs>=0.17',
         'jinja2',
+        'pyyaml',
     ],
     classifiers=[
         'Development Status :: 3 - Alpha',
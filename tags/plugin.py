@@ -5,8 +5,13 @@
 # MIT License
 # --------------------------------------------
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import groupby
 from pathlib import Path
+import mmap
 import os
+import string
 import yaml
 import jinja2
 from jinja2.ext import Extension
@@ -14,13 +19,58 @@ from mkdocs.structure.files import File
 from mkdocs.structure.nav import Section
 from mkdocs.plugins import BasePlugin
 from mkdocs.config.config_options import Type
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
 try:
     from pymdownx.slugs import uslugify_cased_encoded as slugify
 except ImportError:
     from markdown.extensions.toc import slugify
 
 
+class TagsBytecodeCache(jinja2.FileSystemBytecodeCache):
+    """
+    Bytecode cache in which any I/O failure is just a cache miss
+    """
+
+    def load_bytecode(self, bucket):
+        try:
+            super(TagsBytecodeCache, self).load_bytecode(bucket)
+        except OSError:
+            pass
+
+    def dump_bytecode(self, bucket):
+        try:
+            super(TagsBytecodeCache, self).dump_bytecode(bucket)
+        except OSError:
+            pass
+
+
+def get_bytecode_cache():
+    # Compiled templates are kept on disk, so that new processes (as
+    # those spawned on livereload) do not have to compile them again.
+    # Jinja's default directory is private to the user, and refused
+    # if someone else owns it
+    try:
+        return TagsBytecodeCache(pattern="%s.cache")
+    except (OSError, RuntimeError):
+        return None
+
+
+_SLUG_CHARS = frozenset(string.ascii_lowercase + string.digits)
+
+# Metadata of already parsed files, as (mtime, size, meta) by path
+_META_CACHE = {}
+
+
+@lru_cache(maxsize=4096)
 def slugify_this(text):
+    # Lowercase ascii words separated by single spaces give the same slug
+    # with every slugify implementation, so skip the regex work for them
+    words = text.split(" ")
+    if all(w and _SLUG_CHARS.issuperset(w) for w in words):
+        return "-".join(words)
     return slugify(text, '-')
 
 
@@ -49,6 +99,9 @@ class TagsPlugin(BasePlugin):
         self.tags_filename = "tags.md"
         self.tags_folder = "aux"
         self.tags_template = None
+        self._env = None
+        self._env_key = None
+        self._template = None
 
     def on_nav(self, nav, config, files):
         # nav.items.insert(1, nav.items.pop(-1))
@@ -71,11 +124,14 @@ class TagsPlugin(BasePlugin):
             self.tags_template = Path(self.config.get("tags_template"))
 
     def on_files(self, files, config):
-        # Scan the list of files to extract tags from meta
-        for f in files:
-            if not f.src_path.endswith(".md"):
-                continue
-            self.metadata.append(get_metadata(f.src_path, config["docs_dir"]))
+        # Scan the list of files to extract tags from meta. Files are
+        # read in parallel, since most of the time is spent in I/O
+        md_paths = [f.src_path for f in files if f.src_path.endswith(".md")]
+        workers = min(32, (os.cpu_count() or 1) * 4)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(
+                lambda name: get_metadata(name, config["docs_dir"]), md_paths)
+            self.metadata.extend(m for m in results if m is not None)
 
         # Create new file with tags
         self.generate_tags_file()
@@ -89,86 +145,172 @@ class TagsPlugin(BasePlugin):
         )
         files.append(newfile)
 
-    def generate_tags_page(self, data):
+    def _get_template(self):
+        # Build the jinja environment only once, and reuse the compiled
+        # template while the configured template file does not change
         if self.tags_template is None:
             templ_path = Path(__file__).parent / Path("templates")
-            environment = jinja2.Environment(
-                loader=jinja2.FileSystemLoader(str(templ_path)),
-                extensions=[SlugifyExtension]
-            )
-            templ = environment.get_template("tags.md.template")
+            templ_name = "tags.md.template"
         else:
-            environment = jinja2.Environment(
-                loader=jinja2.FileSystemLoader(
-                    searchpath=str(self.tags_template.parent)),
-                extensions=[SlugifyExtension]
-            )
-            templ = environment.get_template(str(self.tags_template.name))
-        stags = sorted(data.items(), key=lambda t: t[0].lower())
-        dtags = {}
-        for stag in stags:
-            try:
-                tagletter = stag[0][0].upper()
-                if tagletter not in dtags:
-                    dtags[tagletter] = [stag]
-                else:
-                    dtags[tagletter].append(stag)
-            except:
-                pass
-        ldtags = sorted(dtags.items())
-        output_text = templ.render(
-            tags=ldtags,
+            templ_path = self.tags_template.parent
+            templ_name = str(self.tags_template.name)
+        try:
+            mtime = (templ_path / templ_name).stat().st_mtime_ns
+        except OSError:
+            mtime = None
+        key = (self.tags_template, mtime)
+        if self._template is not None and self._env_key == key:
+            return self._template
+        self._env = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(searchpath=str(templ_path)),
+            extensions=[SlugifyExtension],
+            bytecode_cache=get_bytecode_cache(),
+            auto_reload=False,
+            cache_size=400
+        )
+        self._env_key = key
+        self._template = self._env.get_template(templ_name)
+        return self._template
+
+    def _group_tags(self, data):
+        # Sorting by initial letter first makes each letter contiguous,
+        # so the tags can be grouped in a single pass
+        stags = sorted(data.items(), key=lambda t: (tag_sort_key(t[0]), t[0]))
+        return [(letter, list(group)) for letter, group in
+                groupby(stags, key=lambda t: t[0][:1].upper()) if letter]
+
+    def generate_tags_page(self, data):
+        output_text = self._get_template().render(
+            tags=self._group_tags(data),
         )
         return output_text
 
+    def _render_to(self, data, fileobj):
+        # Write the page while it is rendered, instead of building
+        # the whole text in memory first
+        self._get_template().stream(
+            tags=self._group_tags(data),
+        ).dump(fileobj, encoding="utf-8")
+
     def generate_tags_file(self):
-        if self.metadata:
-            sorted_meta = sorted(
-                self.metadata, key=lambda e: e.get("year", 5000) if e else 0)
-        else:
-            sorted_meta = {}
-        tag_dict = defaultdict(list)
-        for e in sorted_meta:
-            if not e:
-                continue
+        pages = [e for e in self.metadata if e]
+        for e in pages:
             if "title" not in e:
                 e["title"] = "Untitled"
-            tags = e.get("topic-tags", e.get("topic-auto", e.get("tags", [])))
-            if tags is not None:
-                for tag in tags:
-                    tag_dict[tag].append(e)
-
-        t = self.generate_tags_page(tag_dict)
+        # Buckets hold indexes into pages, the page dicts are only
+        # looked up again when the buckets are sorted and rendered
+        tag_dict = defaultdict(list)
+        for i, e in enumerate(pages):
+            for tag in get_tags(e):
+                tag_dict[tag].append(i)
+        # Pages of each tag are sorted by year and then by title, so
+        # that templates do not need to sort them. Sorting each bucket
+        # is cheaper than sorting all the pages first
+        order = [(e.get("year", 5000), str(e["title"])) for e in pages]
+        for ids in tag_dict.values():
+            ids.sort(key=order.__getitem__)
+        tag_pages = {tag: [pages[i] for i in ids]
+                     for tag, ids in tag_dict.items()}
 
-        with open(str(self.tags_folder / self.tags_filename), "w") as f:
-            f.write(t)
+        # A large buffer batches the small chunks streamed by jinja
+        # into a few writes
+        with open(str(self.tags_folder / self.tags_filename), "wb",
+                  buffering=1 << 20) as f:
+            self._render_to(tag_pages, f)
 
 # Helper functions
 
 
+def tag_sort_key(tag):
+    # Tags are listed by initial letter, and then alphabetically
+    return (tag[:1].upper(), tag.lower())
+
+
+def get_tags(meta):
+    # Tags can be given under several keys, the first one found is used.
+    # A single string is taken as a single tag
+    tags = meta.get("topic-tags")
+    if tags is None:
+        tags = meta.get("topic-auto")
+    if tags is None:
+        tags = meta.get("tags")
+    if tags is None:
+        return []
+    if isinstance(tags, str):
+        return [tags]
+    return tags
+
+
+def find_yaml_end(data, start):
+    # Position of the newline before the closing "---" line (which may
+    # only have trailing whitespace after the dashes), or -1
+    pos = data.find(b"\n---", start)
+    while pos >= 0:
+        eol = data.find(b"\n", pos + 4)
+        if not data[pos + 4:eol if eol >= 0 else len(data)].strip():
+            return pos
+        pos = data.find(b"\n---", pos + 4)
+    return -1
+
+
 def get_metadata(name, path):
-    # Extract metadata from the yaml at the beginning of the file
+    # Extract metadata from the yaml at the beginning of the file.
+    # Only the header matters, so read a small prefix and search it.
+    # Files not starting with "---" are rejected without decoding them
     def extract_yaml(f):
-        result = []
-        c = 0
-        for line in f:
-            if line.strip() == "---":
-                c += 1
-                continue
-            if c == 2:
-                break
-            if c == 1:
-                result.append(line)
-        return "".join(result)
+        head = f.read(8192)
+        start = head.find(b"\n")
+        if start < 0 or not head.startswith(b"---") or head[3:start].strip():
+            return ""
+        truncated = len(head) == 8192
+        if truncated:
+            # The last line of the prefix may continue past it, so it
+            # cannot be told apart from a delimiter yet
+            end = find_yaml_end(head[:head.rfind(b"\n") + 1], start)
+        else:
+            end = find_yaml_end(head, start)
+        if end < 0:
+            if not truncated:
+                # The whole file was read, and it has no header
+                return ""
+            # Closing delimiter not found in the prefix, search the rest
+            # of the file (from the last complete line) without reading
+            # it all
+            from_pos = head.rfind(b"\n")
+            try:
+                with mmap.mmap(f.fileno(), 0,
+                               access=mmap.ACCESS_READ) as mm:
+                    end = find_yaml_end(mm, from_pos)
+                    head = mm[:end] if end >= 0 else b""
+            except (ValueError, OSError):
+                # File not mappable (or truncated meanwhile)
+                head += f.read()
+                end = find_yaml_end(head, from_pos)
+            if end < 0:
+                return ""
+        try:
+            return head[start + 1:end].decode("utf-8")
+        except UnicodeDecodeError:
+            return ""
 
     filename = Path(path) / Path(name)
-    with filename.open() as f:
-        meta = []
+    # Unchanged files are not parsed again on rebuilds
+    st = filename.stat()
+    key = str(filename)
+    cached = _META_CACHE.get(key)
+    if cached is not None and cached[:2] == (st.st_mtime_ns, st.st_size):
+        return cached[2]
+
+    meta = None
+    with filename.open("rb") as f:
         metadata = extract_yaml(f)
-        if metadata:
-            try:
-                meta = yaml.load(metadata, Loader=yaml.FullLoader)
-                meta.update(filename=name)
-            except:
-                pass
-            return meta
+    if metadata:
+        meta = []
+        try:
+            meta = yaml.load(metadata, Loader=SafeLoader)
+            meta.update(filename=name)
+        except:
+            pass
+
+    _META_CACHE[key] = (st.st_mtime_ns, st.st_size, meta)
+    return meta
@@ -0,0 +1,68 @@
+from tags.plugin import get_metadata
+
+
+def write(tmp_path, data, name="page.md"):
+    (tmp_path / name).write_bytes(data)
+    return get_metadata(name, str(tmp_path))
+
+
+def test_simple_header(tmp_path):
+    meta = write(tmp_path, b"---\ntitle: A\ntags: [t]\n---\n# Body\n")
+    assert meta == {"title": "A", "tags": ["t"], "filename": "page.md"}
+
+
+def test_no_header(tmp_path):
+    assert write(tmp_path, b"# Title\n\n---\ntitle: A\n---\n") is None
+
+
+def test_crlf_header(tmp_path):
+    meta = write(tmp_path, b"---\r\ntitle: A\r\ntags: [t]\r\n---\r\nBody\r\n")
+    assert meta["title"] == "A"
+    assert meta["tags"] == ["t"]
+
+
+def test_delimiters_with_trailing_whitespace(tmp_path):
+    meta = write(tmp_path, b"--- \ntitle: A\ntags: [t]\n---  \nBody\n")
+    assert meta["tags"] == ["t"]
+
+
+def test_dash_lines_inside_header(tmp_path):
+    meta = write(tmp_path,
+                 b"---\ntitle: A\n---bar: 1\n----: 2\ntags: [t]\n---\n")
+    assert meta["title"] == "A"
+    assert meta["tags"] == ["t"]
+
+
+def test_header_longer_than_prefix(tmp_path):
+    lines = b"".join(b"k%d: %d\n" % (i, i) for i in range(2000))
+    meta = write(tmp_path, b"---\n" + lines + b"tags: [t]\n---\nBody\n")
+    assert meta["tags"] == ["t"]
+    assert meta["k1999"] == 1999
+
+
+def test_dash_line_across_prefix_boundary(tmp_path):
+    # A "---key: v" line starting near the end of the 8 KiB prefix must
+    # not be taken as the closing delimiter
+    for offset in range(8180, 8192):
+        head = b"---\ntitle: A\npad: "
+        pad = b"x" * (offset - len(head) - 1)
+        data = head + pad + b"\n---key: v\ntags: [t]\n---\nBody\n"
+        assert data.index(b"\n---key") + 1 == offset
+        meta = write(tmp_path, data)
+        assert meta["tags"] == ["t"], offset
+
+
+def test_delimiter_across_prefix_boundary(tmp_path):
+    # A real closing delimiter with trailing whitespace which is split
+    # by the 8 KiB prefix
+    for offset in range(8180, 8192):
+        head = b"---\ntitle: A\ntags: [t]\npad: "
+        pad = b"x" * (offset - len(head) - 1)
+        data = head + pad + b"\n---      \nBody\n" + b"y" * 10000
+        meta = write(tmp_path, data)
+        assert meta["tags"] == ["t"], offset
+
+
+def test_changed_file_is_parsed_again(tmp_path):
+    assert write(tmp_path, b"---\ntitle: A\n---\n")["title"] == "A"
+    assert write(tmp_path, b"---\ntitle: Longer\n---\n")["title"] == "Longer"